@@ -1,38 +1,314 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
+import heapq
+import logging
 import math
-import random
-from datetime import datetime, timedelta
-from hashlib import sha256
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Optional
+from types import MappingProxyType
+from typing import Dict, List, Optional, Tuple
 from uuid import uuid4
 
 import cv2
 import mediapipe as mp
 import numpy as np
-from fastapi import FastAPI, File, HTTPException, Request, UploadFile
+from fastapi import FastAPI, File, HTTPException, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel, Field
 
+try:  # xxhash は任意依存。無ければ hashlib (OpenSSL) の SHA-256 を使う
+    import xxhash
+except ImportError:  # pragma: no cover - optional dependency
+    xxhash = None
+
+logger = logging.getLogger(__name__)
+
+try:  # libjpeg-turbo があれば JPEG を直接 RGB にデコードする
+    from turbojpeg import TJPF_RGB, TurboJPEG
+except ImportError:  # pragma: no cover - optional dependency
+    _turbo_jpeg = None
+else:
+    try:
+        _turbo_jpeg = TurboJPEG()
+    except (OSError, RuntimeError) as exc:  # pragma: no cover - missing/old libturbojpeg
+        # パッケージはあるのにライブラリが使えない場合は設定ミスなので警告を出す
+        logger.warning("libjpeg-turbo unavailable, decoding JPEGs with OpenCV: %s", exc)
+        _turbo_jpeg = None
+
+try:  # ONNX 版 FaceMesh を使う場合のみ必要
+    import onnxruntime as ort
+except ImportError:  # pragma: no cover - optional dependency
+    ort = None
+
 MAX_FILE_BYTES = 5 * 1024 * 1024  # 5MB
-ANALYSIS_TTL = timedelta(minutes=30)
+UPLOAD_CHUNK_BYTES = 64 * 1024
+JPEG_MAGIC = b"\xff\xd8\xff"
+PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+ANALYSIS_TTL = 30 * 60  # 秒
+ANALYSIS_STORE_MAX_ENTRIES = 10_000
+INFERENCE_CACHE_SIZE = 1024
+INFERENCE_MAX_SIDE = 640  # FaceMesh に渡す画像の長辺上限 (px)
+# 推論スレッド数。既定は CPU コア数
+INFERENCE_THREADS = int(os.environ.get("INFERENCE_THREADS", "0")) or (os.cpu_count() or 1)
+
+# FaceMesh ランドマークモデルの ONNX 版。未指定なら MediaPipe を使う
+# (scripts/quantize_face_landmark.py で fp32 / int8 の両方を生成できる)
+FACE_LANDMARK_MODEL = os.environ.get("FACE_LANDMARK_MODEL")
+# int8 量子化版。VNNI 対応 CPU でのみ FACE_LANDMARK_MODEL より優先する
+FACE_LANDMARK_MODEL_INT8 = os.environ.get("FACE_LANDMARK_MODEL_INT8")
+LANDMARK_INPUT_SIZE = 192
+LANDMARK_COUNT = 468
+FACE_CROP_SCALE = 1.5  # 検出枠をこの倍率で広げてランドマークモデルに渡す
 
 BASE_DIR = Path(__file__).resolve().parent
 STATIC_DIR = BASE_DIR / "static"
 TEMPLATES_DIR = BASE_DIR / "templates"
+STATIC_CACHE_CONTROL = "public, max-age=31536000, immutable"
+INDEX_CACHE_CONTROL = "public, max-age=300"
+
 
 app = FastAPI(title="Face Diagnosis App", version="0.2.0")
 
 mp_face_mesh = mp.solutions.face_mesh
-face_mesh = mp_face_mesh.FaceMesh(
-    max_num_faces=1,
-    min_detection_confidence=0.5,
-    min_tracking_confidence=0.5,
+mp_face_detection = mp.solutions.face_detection
+
+
+class MediaPipeLandmarker:
+    """Run the bundled MediaPipe FaceMesh graph."""
+
+    def __init__(self) -> None:
+        # アップロードは互いに無関係な静止画なので、前フレームを使うトラッキングは無効にする
+        self._face_mesh = mp_face_mesh.FaceMesh(
+            static_image_mode=True,
+            max_num_faces=1,
+            min_detection_confidence=0.5,
+        )
+
+    def detect(self, rgb_image: np.ndarray) -> Optional[np.ndarray]:
+        """Return normalized (N, 2) landmark coordinates, or None if no face."""
+
+        results = self._face_mesh.process(rgb_image)
+        if not results.multi_face_landmarks:
+            return None
+        return _landmark_list_to_array(results.multi_face_landmarks[0])
+
+
+# NormalizedLandmark(x, y, z) 1件分のワイヤフォーマット: タグ・長さ + (タグ, float32) x 3
+_LANDMARK_WIRE_DTYPE = np.dtype(
+    [
+        ("tag", "u1"),
+        ("size", "u1"),
+        ("x_tag", "u1"),
+        ("x", "<f4"),
+        ("y_tag", "u1"),
+        ("y", "<f4"),
+        ("z_tag", "u1"),
+        ("z", "<f4"),
+    ]
 )
+_LANDMARK_WIRE_HEADER = {"tag": 0x0A, "size": 15, "x_tag": 0x0D, "y_tag": 0x15, "z_tag": 0x1D}
+
+
+def _landmark_list_to_array(face_landmarks) -> np.ndarray:
+    """Convert a NormalizedLandmarkList to an (N, 2) array of x/y.
+
+    Parsing the serialized message in one np.frombuffer call avoids a
+    protobuf accessor round-trip per coordinate. If the message does not
+    have the plain x/y/z layout (e.g. visibility is set), fall back to
+    iterating the landmarks.
+    """
+
+    raw = face_landmarks.SerializeToString()
+    count = len(face_landmarks.landmark)
+    if count and len(raw) == count * _LANDMARK_WIRE_DTYPE.itemsize:
+        records = np.frombuffer(raw, dtype=_LANDMARK_WIRE_DTYPE)
+        if all(
+            (records[field] == value).all()
+            for field, value in _LANDMARK_WIRE_HEADER.items()
+        ):
+            return np.column_stack((records["x"], records["y"])).astype(np.float64)
+    return np.fromiter(
+        (c for lm in face_landmarks.landmark for c in (lm.x, lm.y)),
+        dtype=np.float64,
+    ).reshape(-1, 2)
+
+
+class OnnxLandmarker:
+    """Run an ONNX export of the FaceMesh landmark model with ONNX Runtime.
+
+    The face RoI comes from MediaPipe's BlazeFace detector; the square crop
+    around it is resized to 192x192 and fed to the landmark model.
+    """
+
+    def __init__(self, model_path: str) -> None:
+        if ort is None:
+            raise RuntimeError("FACE_LANDMARK_MODEL を使うには onnxruntime が必要です")
+        self._session = _onnx_session(model_path)
+        self._use_cuda = self._session.get_providers()[0] == "CUDAExecutionProvider"
+        model_input = self._session.get_inputs()[0]
+        self._input_name = model_input.name
+        self._channels_first = model_input.shape[1] == 3
+        self._output_name = _landmark_output_name(self._session)
+        self._detector = mp_face_detection.FaceDetection(
+            model_selection=0, min_detection_confidence=0.5
+        )
+
+    @property
+    def input_name(self) -> str:
+        return self._input_name
+
+    def detect(self, rgb_image: np.ndarray) -> Optional[np.ndarray]:
+        """Return normalized (468, 2) landmark coordinates, or None if no face."""
+
+        crop = self.crop(rgb_image)
+        if crop is None:
+            return None
+        tensor, scale, left, top = crop
+
+        if self._use_cuda:
+            # 入力だけ GPU に転送し、出力はランドマークテンソルのみ CPU に戻す
+            binding = self._session.io_binding()
+            binding.bind_cpu_input(self._input_name, tensor)
+            binding.bind_output(self._output_name, "cuda")
+            self._session.run_with_iobinding(binding)
+            mesh = binding.copy_outputs_to_cpu()[0]
+        else:
+            mesh = self._session.run([self._output_name], {self._input_name: tensor})[0]
+        mesh = mesh.reshape(LANDMARK_COUNT, 3)[:, :2].astype(np.float64)
+        # クロップ座標 (0..192 px) → 元画像の正規化座標 (0..1)
+        height, width = rgb_image.shape[:2]
+        mesh[:, 0] = (mesh[:, 0] / scale + left) / width
+        mesh[:, 1] = (mesh[:, 1] / scale + top) / height
+        return mesh
+
+    def crop(
+        self, rgb_image: np.ndarray
+    ) -> Optional[Tuple[np.ndarray, float, float, float]]:
+        """Return the model input tensor and its (scale, left, top) crop transform."""
+
+        detections = self._detector.process(rgb_image).detections
+        if not detections:
+            return None
+        height, width = rgb_image.shape[:2]
+        box = detections[0].location_data.relative_bounding_box
+        side = max(box.width * width, box.height * height) * FACE_CROP_SCALE
+        if side <= 0:
+            return None
+        left = (box.xmin + box.width / 2) * width - side / 2
+        top = (box.ymin + box.height / 2) * height - side / 2
+
+        scale = LANDMARK_INPUT_SIZE / side
+        transform = np.array(
+            [[scale, 0.0, -left * scale], [0.0, scale, -top * scale]],
+            dtype=np.float32,
+        )
+        crop = cv2.warpAffine(
+            rgb_image,
+            transform,
+            (LANDMARK_INPUT_SIZE, LANDMARK_INPUT_SIZE),
+            flags=cv2.INTER_LINEAR,
+            borderMode=cv2.BORDER_CONSTANT,
+        )
+        tensor = crop.astype(np.float32)[np.newaxis] / 255.0
+        if self._channels_first:
+            tensor = np.ascontiguousarray(tensor.transpose(0, 3, 1, 2))
+        return tensor, scale, left, top
+
+
+def _landmark_output_name(session) -> str:
+    """Pick the (1, 1404) landmark tensor among the model outputs."""
+
+    outputs = session.get_outputs()
+    for output in outputs:
+        dims = [dim for dim in output.shape if isinstance(dim, int)]
+        if math.prod(dims) == LANDMARK_COUNT * 3:
+            return output.name
+    return outputs[0].name
+
+
+# CUDA のセッションは GPU メモリアリーナとストリームを持つため、全スレッドで1つを共有する
+# (InferenceSession.run はスレッドセーフ)。CPU のセッションはスレッドごとに作る
+_cuda_sessions: Dict[str, "ort.InferenceSession"] = {}
+_cuda_sessions_lock = threading.Lock()
+
+
+def _onnx_session(model_path: str) -> "ort.InferenceSession":
+    """Return the shared CUDA session for ``model_path``, or a new CPU session."""
+
+    if "CUDAExecutionProvider" not in ort.get_available_providers():
+        return _new_onnx_session(model_path, ["CPUExecutionProvider"])
+    with _cuda_sessions_lock:
+        session = _cuda_sessions.get(model_path)
+        if session is None:
+            session = _new_onnx_session(
+                model_path, ["CUDAExecutionProvider", "CPUExecutionProvider"]
+            )
+            _cuda_sessions[model_path] = session
+        return session
+
+
+def _new_onnx_session(model_path: str, providers: List[str]) -> "ort.InferenceSession":
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    # リクエスト間の並列化はスレッドプールで行うので、セッション内は1スレッドにする
+    options.intra_op_num_threads = 1
+    return ort.InferenceSession(model_path, sess_options=options, providers=providers)
+
+
+def _cpu_has_vnni() -> bool:
+    try:
+        cpuinfo = Path("/proc/cpuinfo").read_text()
+    except OSError:  # pragma: no cover - non-Linux hosts
+        return False
+    flags = set(cpuinfo.split())
+    return bool(flags & {"avx512_vnni", "avx_vnni", "amx_int8"})
+
+
+def _select_landmark_model() -> Optional[str]:
+    """Pick the ONNX landmark model to load, or None for MediaPipe.
+
+    The int8 model is only used on CPU hosts with VNNI; without those
+    instructions (or on CUDA) int8 kernels are slower than fp32.
+    """
+
+    if FACE_LANDMARK_MODEL_INT8 and ort is not None:
+        on_cuda = "CUDAExecutionProvider" in ort.get_available_providers()
+        if _cpu_has_vnni() and not on_cuda:
+            return FACE_LANDMARK_MODEL_INT8
+    return FACE_LANDMARK_MODEL
+
+
+def _create_landmarker() -> MediaPipeLandmarker | OnnxLandmarker:
+    model_path = _select_landmark_model()
+    if model_path:
+        return OnnxLandmarker(model_path)
+    return MediaPipeLandmarker()
+
+
+# OpenCV / MediaPipe / ONNX Runtime は GIL を解放するので、INFERENCE_THREADS 本の
+# スレッドで並列に処理する。ランドマーカーはスレッドごとに1つ持つ (CUDA の ORT
+# セッションのみ全スレッドで共有)
+_inference_executor = ThreadPoolExecutor(
+    max_workers=INFERENCE_THREADS, thread_name_prefix="face-analyze"
+)
+_thread_state = threading.local()
+
+# 同じ画像の再アップロード (撮り直しせずに再認識した場合など) は推論を省略する。
+# 値は (期限, 解析結果) で、analysis_id はリクエストごとに新しく発行する。
+# 期限は analysis_store と同じ ANALYSIS_TTL
+_inference_cache: OrderedDict[bytes, Tuple[float, dict]] = OrderedDict()
+_inference_cache_lock = threading.Lock()
 
 TARGET_LANDMARKS = [
     ("chin_tip", 152),
@@ -50,6 +326,10 @@ TARGET_LANDMARKS = [
     ("upper_cheek_left", 50),
     ("upper_cheek_right", 280),
 ]
+_TARGET_NAMES = tuple(name for name, _ in TARGET_LANDMARKS)
+_TARGET_IDX = np.array([idx for _, idx in TARGET_LANDMARKS], dtype=np.int32)
+# FaceMesh は常に LANDMARK_COUNT 点以上を返すので、推論時の範囲チェックは不要
+assert int(_TARGET_IDX.max()) < LANDMARK_COUNT
 
 FACE_SHAPE_LABELS = {
     "round": "丸顔",
@@ -60,6 +340,76 @@ FACE_SHAPE_LABELS = {
     "diamond": "ひし形",
 }
 
+FACE_SHAPE_TIPS = MappingProxyType(
+    {
+        "oval": "オーバル輪郭は万能タイプ。前髪で印象調整がしやすいです。",
+        "round": "丸顔さんは縦ラインを意識するとシャープに見えます。",
+        "heart": "逆三角形はトップにボリュームを出すと華やかさアップ。",
+        "square": "ベース型は柔らかいカールでフェイスラインをカバー。",
+        "long": "面長さんは横ラインや前髪でバランスを取ると◎。",
+        "diamond": "ひし形タイプは頬骨を意識したハイライトで立体感を演出。",
+    }
+)
+DEFAULT_FACE_SHAPE_TIP = "バランスの良いフェイスラインです。"
+
+# (下限スコア, ラベル) を降順に並べる。最後の要素はどれにも当てはまらない場合
+_SYMMETRY_BUCKETS = ((0.85, "シンメトリー◎"), (0.7, "バランス良好"), (-1.0, "左右差あり"))
+_QUALITY_BUCKETS = ((0.85, "とても鮮明"), (0.7, "十分な明るさ"), (-1.0, "少し暗め"))
+
+# 特徴量が得られない場合のフォールバック判定 (_legacy_face_shape_classification) の閾値
+ASPECT_LONG_STRONG = 1.40
+HEART_FOREHEAD_MIN = 0.90
+HEART_JAW_MAX = 0.75
+HEART_TEMPLE_MIN = 0.85
+HEART_JAW_ANGLE_MAX = 110.0
+DIAMOND_PROMINENCE_MIN = 1.10
+DIAMOND_FOREHEAD_MAX = 0.85
+DIAMOND_JAW_MAX = 0.75
+SQUARE_JAW_MIN = 0.80
+SQUARE_JAWLINE_MIN = 0.95
+SQUARE_JAW_ANGLE_MIN = 125.0
+SQUARE_FOREHEAD_MAX = 0.95
+ROUND_ASPECT_MAX = 1.15
+ROUND_FOREHEAD_DELTA_MAX = 0.10
+ROUND_JAW_MIN = 0.75
+ROUND_JAW_ANGLE_MIN = 115.0
+
+_LEGACY_SHAPES = ("oval", "long", "heart", "diamond", "square", "round")
+_SHAPE_OVAL, _SHAPE_LONG, _SHAPE_HEART, _SHAPE_DIAMOND, _SHAPE_SQUARE, _SHAPE_ROUND = (
+    range(len(_LEGACY_SHAPES))
+)
+
+_LEGACY_IDX = {name: idx for idx, name in enumerate(_TARGET_NAMES)}
+_IDX_CHIN_TIP = _LEGACY_IDX["chin_tip"]
+_IDX_JAW_CORNER_LEFT = _LEGACY_IDX["jaw_corner_left"]
+_IDX_JAW_CORNER_RIGHT = _LEGACY_IDX["jaw_corner_right"]
+_IDX_FOREHEAD_CENTER = _LEGACY_IDX["forehead_center"]
+# 左右対称性の評価に使う左右ペア (jaw / jaw_corner / cheek / temple / forehead / upper_cheek)
+_MIRROR_PAIRS = [
+    (_LEGACY_IDX[name], _LEGACY_IDX[name[: -len("_left")] + "_right"])
+    for name in _TARGET_NAMES
+    if name.endswith("_left")
+]
+_MIRROR_LEFT_IDX = np.array([left for left, _ in _MIRROR_PAIRS], dtype=np.intp)
+_MIRROR_RIGHT_IDX = np.array([right for _, right in _MIRROR_PAIRS], dtype=np.intp)
+# 左右差 (顔幅比) に対する対称性スコアの減衰係数。差 3% で約 0.86
+SYMMETRY_SENSITIVITY = 5.0
+# 顔高・頬幅・こめかみ幅・額幅・顎幅・エラ幅・頬骨上部幅の順
+_LEGACY_DISTANCE_PAIRS = np.array(
+    [
+        [_LEGACY_IDX[a], _LEGACY_IDX[b]]
+        for a, b in (
+            ("chin_tip", "forehead_center"),
+            ("cheek_left", "cheek_right"),
+            ("temple_left", "temple_right"),
+            ("forehead_left", "forehead_right"),
+            ("jaw_left", "jaw_right"),
+            ("jaw_corner_left", "jaw_corner_right"),
+            ("upper_cheek_left", "upper_cheek_right"),
+        )
+    ]
+)
+
 
 # exp/feature_report.md から抽出したデータドリブンなプロトタイプ
 FEATURE_METRICS = (
@@ -170,8 +520,50 @@ PROTOTYPE_STATS = {
     },
 }
 
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles that lets browsers and CDNs cache assets for a year.
+
+    Templates append ``?v=<content hash>`` via ``asset_version`` so changed
+    files get a new URL.
+    """
+
+    def file_response(self, *args, **kwargs) -> Response:
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = STATIC_CACHE_CONTROL
+        return response
+
+
+def asset_version(path: str) -> str:
+    """Return a short content hash for a file under STATIC_DIR."""
+
+    stat = (STATIC_DIR / path).stat()
+    return _asset_digest(path, stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=None)
+def _asset_digest(path: str, mtime_ns: int, size: int) -> str:
+    # mtime/size をキーにしているので、開発中にファイルを更新してもハッシュが変わる
+    return hashlib.sha256((STATIC_DIR / path).read_bytes()).hexdigest()[:12]
+
+
 templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
-app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+templates.env.globals["asset_version"] = asset_version
+app.mount("/static", CachedStaticFiles(directory=STATIC_DIR), name="static")
+
+
+def _render_index() -> bytes:
+    """Render index.html once; its only request-dependent part is url_for."""
+
+    def url_for(name: str, /, **path_params: str) -> str:
+        return app.url_path_for(name, **path_params)
+
+    html = templates.get_template("index.html").render(url_for=url_for)
+    return html.encode("utf-8")
+
+
+# テンプレートと asset_version のハッシュは起動時に確定する (静的ファイル更新時は再起動)
+_INDEX_HTML = _render_index()
 
 app.add_middleware(
     CORSMiddleware,
@@ -208,12 +600,27 @@ class DiagnoseResponse(BaseModel):
     result: DiagnoseResult
 
 
-analysis_store: Dict[str, dict] = {}
+# 診断結果は顔型だけで決まるため、顔型ごとに import 時に組み立てて使い回す
+_DIAGNOSE_RESPONSES: Dict[str, DiagnoseResponse] = {
+    shape: DiagnoseResponse.model_construct(
+        result=DiagnoseResult.model_construct(shape=label)
+    )
+    for shape, label in FACE_SHAPE_LABELS.items()
+}
+
+
+# 挿入・参照順の LRU。ANALYSIS_STORE_MAX_ENTRIES を超えたら古いものから捨てる
+analysis_store: OrderedDict[str, dict] = OrderedDict()
+_store_lock = threading.Lock()
+# (期限, analysis_id) の min-heap。先頭から期限切れのものだけを取り出す
+_expiry_heap: List[Tuple[float, str]] = []
 
 
 @app.get("/", response_class=HTMLResponse)
-async def serve_index(request: Request) -> HTMLResponse:
-    return templates.TemplateResponse("index.html", {"request": request})
+async def serve_index() -> HTMLResponse:
+    return HTMLResponse(
+        content=_INDEX_HTML, headers={"Cache-Control": INDEX_CACHE_CONTROL}
+    )
 
 
 @app.get("/api/health")
@@ -226,57 +633,40 @@ async def face_analyze(file: UploadFile = File(...)) -> FaceAnalyzeResponse:
     if file.content_type not in {"image/jpeg", "image/png", "image/webp"}:
         raise HTTPException(status_code=400, detail="対応していないファイル形式です")
 
-    content = await file.read()
+    content, digest = await _read_upload(file)
     if not content:
         raise HTTPException(status_code=400, detail="ファイルが空です")
-    if len(content) > MAX_FILE_BYTES:
-        raise HTTPException(
-            status_code=413, detail="ファイルサイズが大きすぎます (上限5MB)"
-        )
 
-    try:
-        image = _load_image(content)
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    except Exception as exc:  # pragma: no cover - invalid input
-        raise HTTPException(
-            status_code=400, detail="画像の読み込みに失敗しました"
-        ) from exc
-
-    results = face_mesh.process(rgb_image)
-    landmarks: List[Landmark] = []
-    feature_vector: Optional[Dict[str, float]] = None
-    if results.multi_face_landmarks:
-        face_landmarks = results.multi_face_landmarks[0]
-        landmarks = _normalize_mediapipe_landmarks(
-            face_landmarks, image.shape[1], image.shape[0]
-        )
-        feature_vector = _extract_face_shape_features(face_landmarks)
-
-    if not landmarks:
-        raise HTTPException(
-            status_code=400,
-            detail="顔を検出できませんでした。正面を向いて明るい場所で撮影してください。",
-        )
-
-    face_shape = _classify_face_shape(feature_vector, landmarks)
-    quality_score = _calculate_quality(image)
+    loop = asyncio.get_running_loop()
+    processed = await loop.run_in_executor(
+        _inference_executor, _analyze_upload, content, digest
+    )
+    landmarks = processed["landmarks"]
+    face_shape = processed["face_shape"]
+    feature_vector = processed["features"]
+    quality_score = processed["quality_score"]
     quality_label = _quality_label(quality_score)
-    symmetry_score = _calculate_symmetry_mediapipe(landmarks)
-    fingerprint = int(sha256(content).hexdigest()[:8], 16)
+    symmetry_score = processed["symmetry_score"]
+    fingerprint = processed["fingerprint"]
 
     analysis_id = str(uuid4())
-    analysis_store[analysis_id] = {
-        "created_at": datetime.utcnow(),
-        "landmarks": [lm.model_dump() for lm in landmarks],
-        "quality": {"score": quality_score, "label": quality_label},
-        "face_shape": face_shape,
-        "symmetry": {"score": symmetry_score, "label": _symmetry_label(symmetry_score)},
-        "features": feature_vector or {},
-        "fingerprint": fingerprint,
-    }
-    _purge_expired()
+    _store_analysis(
+        analysis_id,
+        {
+            "created_at": time.time(),
+            "landmarks": processed["points"],
+            "quality": {"score": quality_score, "label": quality_label},
+            "face_shape": face_shape,
+            "symmetry": {
+                "score": symmetry_score,
+                "label": _symmetry_label(symmetry_score),
+            },
+            "features": feature_vector or {},
+            "fingerprint": fingerprint,
+        },
+    )
 
-    return FaceAnalyzeResponse(
+    return FaceAnalyzeResponse.model_construct(
         analysisId=analysis_id,
         landmarks=landmarks,
         quality={"score": quality_score, "message": f"撮影状態: {quality_label}"},
@@ -288,62 +678,264 @@ async def face_analyze(file: UploadFile = File(...)) -> FaceAnalyzeResponse:
 
 @app.post("/api/diagnose", response_model=DiagnoseResponse)
 async def diagnose(payload: DiagnoseInput) -> DiagnoseResponse:
-    analysis = analysis_store.get(payload.analysisId)
+    analysis = _get_analysis(payload.analysisId)
     if not analysis:
         raise HTTPException(status_code=404, detail="解析セッションが見つかりません")
 
     if payload.landmarks:
-        analysis["landmarks"] = [lm.model_dump() for lm in payload.landmarks]
+        analysis["landmarks"] = _landmarks_to_array(payload.landmarks)
+
+    return _diagnose_response(analysis["face_shape"])
+
+
+async def _read_upload(file: UploadFile) -> Tuple[bytes, bytes]:
+    """Read the upload in chunks, returning ``(content, digest)``.
+
+    Aborts as soon as the body exceeds MAX_FILE_BYTES; the digest is computed
+    while reading so the buffer is not walked a second time.
+    """
+
+    if file.size is not None and file.size > MAX_FILE_BYTES:
+        raise _file_too_large()
+    declared = file.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > MAX_FILE_BYTES:
+        raise _file_too_large()
+
+    hasher = _content_hasher()
+    buffer = bytearray()
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            break
+        # 先頭チャンクのマジックバイトで画像以外をデコード前に弾く
+        if not buffer and not _has_image_magic(chunk):
+            raise HTTPException(status_code=400, detail="対応していないファイル形式です")
+        buffer.extend(chunk)
+        if len(buffer) > MAX_FILE_BYTES:
+            raise _file_too_large()
+        hasher.update(chunk)
+    return bytes(buffer), hasher.digest()
+
+
+def _has_image_magic(header: bytes) -> bool:
+    """Return True if ``header`` starts like a JPEG, PNG or WebP file."""
+
+    return (
+        header.startswith(JPEG_MAGIC)
+        or header.startswith(PNG_MAGIC)
+        or (header[:4] == b"RIFF" and header[8:12] == b"WEBP")
+    )
 
-    face_shape = analysis["face_shape"]
 
-    descriptor = _build_descriptor(face_shape)
-    return DiagnoseResponse(result=descriptor)
+def _file_too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail="ファイルサイズが大きすぎます (上限5MB)")
 
 
 def _symmetry_label(score: float) -> str:
-    if score >= 0.85:
-        return "シンメトリー◎"
-    if score >= 0.7:
-        return "バランス良好"
-    return "左右差あり"
+    return _bucket_label(score, _SYMMETRY_BUCKETS)
+
+
+def _bucket_label(score: float, buckets: Tuple[Tuple[float, str], ...]) -> str:
+    for threshold, label in buckets:
+        if score >= threshold:
+            return label
+    return buckets[-1][1]
+
+
+def _content_hasher():
+    """Return an incremental hasher for uploads (not used for security)."""
+
+    # 推論キャッシュのキーになるため衝突しにくい 128bit 以上のダイジェストを使う
+    if xxhash is not None:
+        return xxhash.xxh3_128()
+    return hashlib.sha256()
+
 
+def _analyze_upload(content: bytes, digest: bytes) -> dict:
+    """Return the cached analysis for identical bytes, or run the pipeline."""
 
-def _load_image(content: bytes) -> np.ndarray:
+    now = time.time()
+    with _inference_cache_lock:
+        cached = _inference_cache.get(digest)
+        if cached is not None:
+            expires_at, processed = cached
+            if expires_at > now:
+                _inference_cache.move_to_end(digest)
+                return processed
+            del _inference_cache[digest]
+
+    processed = _process_image_sync(content)
+    processed["fingerprint"] = int.from_bytes(digest[:4], "big")
+    with _inference_cache_lock:
+        _inference_cache[digest] = (time.time() + ANALYSIS_TTL, processed)
+        while len(_inference_cache) > INFERENCE_CACHE_SIZE:
+            _inference_cache.popitem(last=False)
+    return processed
+
+
+def _get_landmarker() -> MediaPipeLandmarker | OnnxLandmarker:
+    """Return the landmarker owned by the current worker thread."""
+
+    # MediaPipe のグラフはスレッドセーフではないため、スレッドごとに保持する
+    landmarker = getattr(_thread_state, "landmarker", None)
+    if landmarker is None:
+        landmarker = _create_landmarker()
+        _thread_state.landmarker = landmarker
+    return landmarker
+
+
+def _process_image_sync(content: bytes) -> dict:
+    """Decode, run FaceMesh and score an upload; executed off the event loop."""
+
+    try:
+        image, is_rgb = _load_image(content)
+        rgb_image = _prepare_inference_image(image, is_rgb)
+        # 画質評価も推論サイズの画像で行い、アップロード解像度に依存しないようにする
+        gray = cv2.cvtColor(rgb_image, cv2.COLOR_RGB2GRAY)
+    except Exception as exc:  # pragma: no cover - invalid input
+        raise HTTPException(
+            status_code=400, detail="画像の読み込みに失敗しました"
+        ) from exc
+
+    points = _get_landmarker().detect(rgb_image)
+    target_points = np.empty((0, 2), dtype=np.float64)
+    feature_vector: Optional[Dict[str, float]] = None
+    if points is not None:
+        target_points = _normalize_mediapipe_landmarks(
+            points, image.shape[1], image.shape[0]
+        )
+        feature_vector = _extract_face_shape_features(points)
+
+    if not len(target_points):
+        raise HTTPException(
+            status_code=400,
+            detail="顔を検出できませんでした。正面を向いて明るい場所で撮影してください。",
+        )
+
+    landmarks = _array_to_landmarks(target_points)
+    return {
+        "landmarks": landmarks,
+        "points": target_points.astype(np.float32),
+        "features": feature_vector,
+        "face_shape": _classify_face_shape(feature_vector, target_points),
+        "quality_score": _calculate_quality(gray),
+        "symmetry_score": _calculate_symmetry_mediapipe(target_points),
+    }
+
+
+def _load_image(content: bytes) -> Tuple[np.ndarray, bool]:
+    """Decode an upload, returning ``(image, is_rgb)``.
+
+    Baseline JPEGs go through libjpeg-turbo straight to RGB when PyTurboJPEG
+    is available; everything else (PNG/WebP, or JPEGs whose EXIF orientation
+    needs the rotation cv2.imdecode applies, or that libjpeg-turbo fails to
+    decode) is decoded by OpenCV as BGR.
+    """
+
+    if _turbo_jpeg is not None and content[:3] == JPEG_MAGIC:
+        if _jpeg_orientation(content) == 1:
+            try:
+                return _turbo_jpeg.decode(content, pixel_format=TJPF_RGB), True
+            except (OSError, ValueError):
+                # CMYK など libjpeg-turbo で RGB にできないものは OpenCV に任せる
+                pass
     arr = np.frombuffer(content, np.uint8)
     image = cv2.imdecode(arr, cv2.IMREAD_COLOR)
     if image is None:
         raise ValueError("invalid image data")
-    return image
+    return image, False
+
+
+def _jpeg_orientation(content: bytes) -> int:
+    """Return the EXIF orientation of a JPEG, or 1 when it has none."""
+
+    pos = 2
+    while pos + 4 <= len(content) and content[pos] == 0xFF:
+        marker = content[pos + 1]
+        if marker in (0xD9, 0xDA):  # EOI / SOS 以降にメタデータはない
+            break
+        length = int.from_bytes(content[pos + 2 : pos + 4], "big")
+        if marker == 0xE1 and content[pos + 4 : pos + 10] == b"Exif\0\0":
+            return _exif_orientation(content[pos + 10 : pos + 2 + length])
+        pos += 2 + length
+    return 1
+
+
+def _exif_orientation(tiff: bytes) -> int:
+    if len(tiff) < 8:
+        return 1
+    byteorder = "little" if tiff[:2] == b"II" else "big"
+    ifd = int.from_bytes(tiff[4:8], byteorder)
+    if ifd + 2 > len(tiff):
+        return 1
+    for i in range(int.from_bytes(tiff[ifd : ifd + 2], byteorder)):
+        entry = ifd + 2 + i * 12
+        if entry + 12 > len(tiff):
+            break
+        if int.from_bytes(tiff[entry : entry + 2], byteorder) == 0x0112:
+            return int.from_bytes(tiff[entry + 8 : entry + 10], byteorder)
+    return 1
+
+
+def _prepare_inference_image(image: np.ndarray, is_rgb: bool) -> np.ndarray:
+    """Shrink large uploads and convert to RGB into per-thread scratch buffers.
+
+    FaceMesh accuracy plateaus well below 640px, so the long side is capped
+    at INFERENCE_MAX_SIDE. The returned array may be reused by the next call
+    on the same thread.
+    """
+
+    height, width = image.shape[:2]
+    scale = INFERENCE_MAX_SIDE / max(height, width)
+    if scale < 1.0:
+        # fx/fy 指定と dsize 指定では INTER_AREA のサンプリングが変わるため fx/fy で渡す
+        shape = (round(height * scale), round(width * scale), 3)
+        resized = _scratch_buffer("resize_buf", shape)
+        cv2.resize(
+            image, None, dst=resized, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+        )
+        image = resized
+    if is_rgb:
+        return image
+    rgb_image = _scratch_buffer("rgb_buf", image.shape)
+    cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=rgb_image)
+    return rgb_image
 
 
-def _normalize_mediapipe_landmarks(
-    face_landmarks, width: int, height: int
-) -> List[Landmark]:
-    normalized: List[Landmark] = []
-    for _, idx in TARGET_LANDMARKS:
-        if idx >= len(face_landmarks.landmark):
-            continue
-        lm = face_landmarks.landmark[idx]
-        normalized.append(
-            Landmark(
-                x=round(lm.x * width, 2),
-                y=round(lm.y * height, 2),
-            )
-        )
-    return normalized
+def _scratch_buffer(name: str, shape: Tuple[int, ...]) -> np.ndarray:
+    """Return a uint8 view of the given shape, growing the buffer only when needed."""
 
+    size = math.prod(shape)
+    buffer = getattr(_thread_state, name, None)
+    if buffer is None or buffer.size < size:
+        buffer = np.empty(size, dtype=np.uint8)
+        setattr(_thread_state, name, buffer)
+    return buffer[:size].reshape(shape)
 
-def _landmark_map(landmarks: List[Landmark]) -> Dict[str, Landmark]:
-    if len(landmarks) < len(TARGET_LANDMARKS):
-        return {}
-    return {name: landmarks[idx] for idx, (name, _) in enumerate(TARGET_LANDMARKS)}
 
+def _normalize_mediapipe_landmarks(
+    points: np.ndarray, width: int, height: int
+) -> np.ndarray:
+    """Return the target landmarks as an (N, 2) array of pixel coordinates."""
 
-def _extract_face_shape_features(face_landmarks) -> Optional[Dict[str, float]]:
-    coords = np.array(
-        [(lm.x, lm.y) for lm in face_landmarks.landmark], dtype=np.float32
+    return np.round(
+        points[_TARGET_IDX] * np.array([width, height], dtype=np.float64), 2
     )
+
+
+def _array_to_landmarks(pts: np.ndarray) -> List[Landmark]:
+    # 内部計算の値なのでバリデーションは省略する
+    return [Landmark.model_construct(x=x, y=y) for x, y in pts.tolist()]
+
+
+def _landmarks_to_array(landmarks: List[Landmark]) -> np.ndarray:
+    """Pack landmarks into an (N, 2) float32 array for analysis_store."""
+
+    return np.array([(lm.x, lm.y) for lm in landmarks], dtype=np.float32)
+
+
+def _extract_face_shape_features(points: np.ndarray) -> Optional[Dict[str, float]]:
+    coords = points.astype(np.float32)
     if coords.size == 0:
         return None
     coords = np.clip(coords, 0.0, 1.0)
@@ -385,11 +977,11 @@ def _band_width(rel_coords: np.ndarray, rel_level: float) -> float:
 
 
 def _classify_face_shape(
-    feature_vector: Optional[Dict[str, float]], landmarks: List[Landmark]
+    feature_vector: Optional[Dict[str, float]], pts: np.ndarray
 ) -> str:
     if feature_vector:
         return _classify_face_shape_with_features(feature_vector)
-    return _legacy_face_shape_classification(landmarks)
+    return _legacy_face_shape_classification(pts)
 
 
 def _classify_face_shape_with_features(features: Dict[str, float]) -> str:
@@ -407,58 +999,30 @@ def _classify_face_shape_with_features(features: Dict[str, float]) -> str:
     return best_label
 
 
-def _distance(p1: Landmark, p2: Landmark) -> float:
-    return math.hypot(p1.x - p2.x, p1.y - p2.y)
+def _legacy_face_shape_classification(pts: np.ndarray) -> str:
+    """Fallback classifier based on the (N, 2) target landmark array."""
+
+    if len(pts) < len(_TARGET_NAMES):
+        return "oval"
 
+    return _LEGACY_SHAPES[_classify_legacy_points(pts)]
 
-def _angle(a: Landmark, b: Landmark, c: Landmark) -> float:
-    """Return the ABC angle in degrees (with B as vertex)."""
 
-    ab = (a.x - b.x, a.y - b.y)
-    cb = (c.x - b.x, c.y - b.y)
-    ab_len = math.hypot(*ab)
-    cb_len = math.hypot(*cb)
-    if ab_len == 0 or cb_len == 0:
-        return 0.0
-    cos_angle = max(-1.0, min(1.0, (ab[0] * cb[0] + ab[1] * cb[1]) / (ab_len * cb_len)))
-    return math.degrees(math.acos(cos_angle))
-
-
-def _legacy_face_shape_classification(landmarks: List[Landmark]) -> str:
-    """Fallback classifier based on a small subset of landmarks."""
-
-    lm = _landmark_map(landmarks)
-    required = {
-        "chin_tip",
-        "cheek_left",
-        "cheek_right",
-        "forehead_center",
-        "forehead_left",
-        "forehead_right",
-        "temple_left",
-        "temple_right",
-        "jaw_left",
-        "jaw_right",
-        "jaw_corner_left",
-        "jaw_corner_right",
-        "upper_cheek_left",
-        "upper_cheek_right",
-    }
-    if not required.issubset(lm.keys()):
-        return "oval"
+def _classify_legacy_points(pts: np.ndarray) -> int:
+    """Return an index into _LEGACY_SHAPES for (14, 2) target landmarks."""
 
-    chin = lm["chin_tip"]
-    forehead_center = lm["forehead_center"]
-    cheek_width = _distance(lm["cheek_left"], lm["cheek_right"])
-    temple_width = _distance(lm["temple_left"], lm["temple_right"])
-    forehead_width = _distance(lm["forehead_left"], lm["forehead_right"])
-    jaw_width = _distance(lm["jaw_left"], lm["jaw_right"])
-    jawline_width = _distance(lm["jaw_corner_left"], lm["jaw_corner_right"])
-    upper_cheek_width = _distance(lm["upper_cheek_left"], lm["upper_cheek_right"])
-    face_height = _distance(chin, forehead_center)
+    deltas = pts[_LEGACY_DISTANCE_PAIRS[:, 0]] - pts[_LEGACY_DISTANCE_PAIRS[:, 1]]
+    dists = np.sqrt((deltas * deltas).sum(axis=1))
+    face_height = dists[0]
+    cheek_width = dists[1]
+    temple_width = dists[2]
+    forehead_width = dists[3]
+    jaw_width = dists[4]
+    jawline_width = dists[5]
+    upper_cheek_width = dists[6]
 
     if face_height <= 0 or cheek_width <= 0:
-        return "oval"
+        return _SHAPE_OVAL
 
     # 基本となる比率・角度
     aspect = face_height / cheek_width
@@ -467,11 +1031,21 @@ def _legacy_face_shape_classification(landmarks: List[Landmark]) -> str:
     jaw_vs_cheek = jaw_width / cheek_width
     jawline_vs_cheek = jawline_width / cheek_width
     cheek_prominence = upper_cheek_width / jawline_width if jawline_width else 1.0
-    jaw_angle = _angle(lm["jaw_corner_left"], chin, lm["jaw_corner_right"])
+
+    # 顎先を頂点とした左右エラの角度
+    ab_x = pts[_IDX_JAW_CORNER_LEFT, 0] - pts[_IDX_CHIN_TIP, 0]
+    ab_y = pts[_IDX_JAW_CORNER_LEFT, 1] - pts[_IDX_CHIN_TIP, 1]
+    cb_x = pts[_IDX_JAW_CORNER_RIGHT, 0] - pts[_IDX_CHIN_TIP, 0]
+    cb_y = pts[_IDX_JAW_CORNER_RIGHT, 1] - pts[_IDX_CHIN_TIP, 1]
+    norms = math.hypot(ab_x, ab_y) * math.hypot(cb_x, cb_y)
+    jaw_angle = 0.0
+    if norms > 0:
+        cos_angle = max(-1.0, min(1.0, (ab_x * cb_x + ab_y * cb_y) / norms))
+        jaw_angle = math.degrees(math.acos(cos_angle))
 
     # 1. 面長: 明確に縦長のものを最優先で判定
     if aspect >= ASPECT_LONG_STRONG:
-        return "long"
+        return _SHAPE_LONG
 
     # 2. 逆三角形: 額が広く顎が細い + 上部の横幅が広め + 顎角がシャープ
     if (
@@ -480,7 +1054,7 @@ def _legacy_face_shape_classification(landmarks: List[Landmark]) -> str:
         and temple_vs_cheek >= HEART_TEMPLE_MIN
         and jaw_angle <= HEART_JAW_ANGLE_MAX
     ):
-        return "heart"
+        return _SHAPE_HEART
 
     # 3. ひし形: 頬骨が額・顎より明らかに広く突出
     if (
@@ -488,7 +1062,7 @@ def _legacy_face_shape_classification(landmarks: List[Landmark]) -> str:
         and forehead_vs_cheek <= DIAMOND_FOREHEAD_MAX
         and jaw_vs_cheek <= DIAMOND_JAW_MAX
     ):
-        return "diamond"
+        return _SHAPE_DIAMOND
 
     # 4. ベース型: 顎幅・エラ幅が広く、角ばった輪郭
     if (
@@ -497,7 +1071,7 @@ def _legacy_face_shape_classification(landmarks: List[Landmark]) -> str:
         and jaw_angle >= SQUARE_JAW_ANGLE_MIN
         and forehead_vs_cheek <= SQUARE_FOREHEAD_MAX
     ):
-        return "square"
+        return _SHAPE_SQUARE
 
     # 5. 丸顔: 縦横比が低く、額と頬の幅が近く、顎もふっくら
     if (
@@ -506,58 +1080,89 @@ def _legacy_face_shape_classification(landmarks: List[Landmark]) -> str:
         and jaw_vs_cheek >= ROUND_JAW_MIN
         and jaw_angle >= ROUND_JAW_ANGLE_MIN
     ):
-        return "round"
+        return _SHAPE_ROUND
 
     # 6. どれにも強く当てはまらないものは卵型として扱う
-    return "oval"
+    return _SHAPE_OVAL
 
 
 def _shape_label(shape: str) -> str:
     return FACE_SHAPE_LABELS.get(shape, "バランスタイプ")
 
 
-def _calculate_quality(image: np.ndarray) -> float:
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    blur_score = cv2.Laplacian(gray, cv2.CV_64F).var()
+def _calculate_quality(gray: np.ndarray) -> float:
+    # 既定 (ksize=1) のカーネルなら uint8 入力の結果は int16 に収まる (|v| <= 4 * 255)
+    laplacian = cv2.Laplacian(gray, cv2.CV_16S)
+    _, stddev = cv2.meanStdDev(laplacian)
+    blur_score = float(stddev[0, 0]) ** 2
     focus_score = min(1.0, blur_score / 500.0)
-    brightness_score = min(1.0, np.mean(gray) / 170.0)
+    brightness_score = min(1.0, cv2.mean(gray)[0] / 170.0)
     return round(0.5 * focus_score + 0.5 * brightness_score, 2)
 
 
 def _quality_label(score: float) -> str:
-    if score >= 0.85:
-        return "とても鮮明"
-    if score >= 0.7:
-        return "十分な明るさ"
-    return "少し暗め"
+    return _bucket_label(score, _QUALITY_BUCKETS)
+
+
+def _calculate_symmetry_mediapipe(pts: np.ndarray) -> float:
+    """Score left/right symmetry of the (N, 2) target landmarks in [0, 1]."""
 
+    if len(pts) < len(_TARGET_NAMES):
+        return 0.0
+    face_width = abs(pts[_IDX_JAW_CORNER_RIGHT, 0] - pts[_IDX_JAW_CORNER_LEFT, 0])
+    if face_width <= 0:
+        return 0.0
 
-def _calculate_symmetry_mediapipe(landmarks: List[Landmark]) -> float:
-    return round(0.7 + random.random() * 0.2, 2)
+    # 顎先と額中央を結ぶ正中線に対し、左右ペアの x 座標を鏡映したずれを測る
+    mid_x = (pts[_IDX_CHIN_TIP, 0] + pts[_IDX_FOREHEAD_CENTER, 0]) / 2
+    offsets = (pts[_MIRROR_LEFT_IDX, 0] - mid_x) + (pts[_MIRROR_RIGHT_IDX, 0] - mid_x)
+    err = float(np.mean(np.abs(offsets))) / face_width
+    return round(math.exp(-SYMMETRY_SENSITIVITY * err), 2)
 
 
 def _face_shape_tip(shape: str) -> str:
-    tips = {
-        "oval": "オーバル輪郭は万能タイプ。前髪で印象調整がしやすいです。",
-        "round": "丸顔さんは縦ラインを意識するとシャープに見えます。",
-        "heart": "逆三角形はトップにボリュームを出すと華やかさアップ。",
-        "square": "ベース型は柔らかいカールでフェイスラインをカバー。",
-        "long": "面長さんは横ラインや前髪でバランスを取ると◎。",
-        "diamond": "ひし形タイプは頬骨を意識したハイライトで立体感を演出。",
-    }
-    return tips.get(shape, "バランスの良いフェイスラインです。")
+    return FACE_SHAPE_TIPS.get(shape, DEFAULT_FACE_SHAPE_TIP)
 
 
-def _build_descriptor(face_shape: str) -> DiagnoseResult:
-    return DiagnoseResult(shape=_shape_label(face_shape))
+def _diagnose_response(face_shape: str) -> DiagnoseResponse:
+    response = _DIAGNOSE_RESPONSES.get(face_shape)
+    if response is None:
+        response = DiagnoseResponse.model_construct(
+            result=DiagnoseResult.model_construct(shape=_shape_label(face_shape))
+        )
+    return response
+
+
+def _store_analysis(analysis_id: str, record: dict) -> None:
+    with _store_lock:
+        record["expires_at"] = record["created_at"] + ANALYSIS_TTL
+        analysis_store[analysis_id] = record
+        heapq.heappush(_expiry_heap, (record["expires_at"], analysis_id))
+        while len(analysis_store) > ANALYSIS_STORE_MAX_ENTRIES:
+            analysis_store.popitem(last=False)
+        _purge_expired()
+        # LRU で追い出されたキーの期限エントリがヒープに残り続けないよう、
+        # ストアの2倍を超えたらストアから作り直す (償却 O(1))
+        if len(_expiry_heap) > 2 * len(analysis_store):
+            _expiry_heap[:] = [
+                (value["expires_at"], key) for key, value in analysis_store.items()
+            ]
+            heapq.heapify(_expiry_heap)
+
+
+def _get_analysis(analysis_id: str) -> Optional[dict]:
+    with _store_lock:
+        analysis = analysis_store.get(analysis_id)
+        if analysis is not None:
+            analysis_store.move_to_end(analysis_id)
+        return analysis
 
 
 def _purge_expired() -> None:
-    now = datetime.utcnow()
-    expired_keys = [
-        key
-        for key, value in analysis_store.items()
-        if now - value["created_at"] > ANALYSIS_TTL
-    ]
-    for key in expired_keys:
+    """Drop expired analyses; the caller must hold _store_lock."""
+
+    now = time.time()
+    while _expiry_heap and _expiry_heap[0][0] <= now:
+        _, key = heapq.heappop(_expiry_heap)
+        # LRU で既に追い出されたキーは pop が空振りするだけ
         analysis_store.pop(key, None)
@@ -4,16 +4,18 @@ The script copies the raw crowd-sourced photos under dataset/face-type-photo
 into dataset/face-type-photo-standard with the naming convention requested in
 Slack (e.g., Oval01.png).
 
-It re-encodes images as PNG to match the expected extension, caps the number of
+It re-encodes JPEGs as PNG to match the expected extension, caps the number of
 files per class, and prints a short summary so contributors can tell what is
 missing (currently Diamond has no samples).
 """
 
 from __future__ import annotations
 
+import os
 import shutil
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, Iterable, List
+from typing import Dict, Iterable, List, Tuple
 
 import cv2  # type: ignore
 
@@ -50,6 +52,10 @@ def _iter_source_files(prefixes: Iterable[str]) -> List[Path]:
 
 
 def _convert_to_png(src: Path, dst: Path) -> None:
+    if src.suffix.lower() == ".png":
+        # Already PNG: a plain copy avoids a full decode/re-encode round trip.
+        shutil.copyfile(src, dst)
+        return
     image = cv2.imread(src.as_posix())
     if image is None:
         raise RuntimeError(f"Failed to read image: {src}")
@@ -58,6 +64,10 @@ def _convert_to_png(src: Path, dst: Path) -> None:
         raise RuntimeError(f"Failed to write image: {dst}")
 
 
+def _convert_job(job: Tuple[Path, Path]) -> None:
+    _convert_to_png(*job)
+
+
 def main() -> None:
     if not SOURCE_DIR.exists():
         raise SystemExit(f"Source directory not found: {SOURCE_DIR}")
@@ -67,18 +77,26 @@ def main() -> None:
     TARGET_DIR.mkdir(parents=True)
 
     print(f"Preparing normalized dataset at {TARGET_DIR}")
+    jobs: List[Tuple[Path, Path]] = []
+    summary: List[str] = []
     for label, prefixes in SHAPE_SOURCES.items():
         candidates = _iter_source_files(prefixes)
         if not candidates:
-            print(f"[WARN] No source images found for '{label}' (prefixes={prefixes}).")
+            summary.append(
+                f"[WARN] No source images found for '{label}' (prefixes={prefixes})."
+            )
             continue
 
         limit = min(MAX_PER_CLASS, len(candidates))
         for idx in range(limit):
-            src = candidates[idx]
-            dst = TARGET_DIR / f"{label}{idx + 1:02d}.png"
-            _convert_to_png(src, dst)
-        print(f"[OK] {label}: wrote {limit} file(s) from prefixes {prefixes}.")
+            jobs.append((candidates[idx], TARGET_DIR / f"{label}{idx + 1:02d}.png"))
+        summary.append(f"[OK] {label}: wrote {limit} file(s) from prefixes {prefixes}.")
+
+    # Decoding/encoding is CPU-bound, so convert in parallel across processes.
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        list(executor.map(_convert_job, jobs))
+    for line in summary:
+        print(line)
 
     print("Done. Please drop new images into the raw folder and re-run as needed.")
 
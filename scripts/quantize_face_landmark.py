@@ -0,0 +1,132 @@
+"""Export the FaceMesh landmark model to ONNX and build an INT8 variant.
+
+The TFLite model bundled with mediapipe is converted with tf2onnx, then
+statically quantized (QDQ, per-channel, int8 weights and activations) with
+ONNX Runtime. Calibration uses face crops from the normalized dataset
+created by prepare_face_dataset.py, preprocessed exactly as the app does.
+
+Point the app at the results with:
+
+    FACE_LANDMARK_MODEL=models/face_landmark.onnx
+    FACE_LANDMARK_MODEL_INT8=models/face_landmark_int8.onnx
+
+Requires tf2onnx and onnxruntime in addition to the app requirements.
+"""
+
+from __future__ import annotations
+
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import cv2  # type: ignore
+import mediapipe as mp  # type: ignore
+from onnxruntime.quantization import (  # type: ignore
+    CalibrationDataReader,
+    QuantFormat,
+    QuantType,
+    quantize_static,
+)
+from onnxruntime.quantization.shape_inference import quant_pre_process  # type: ignore
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from app.main import OnnxLandmarker  # noqa: E402
+
+TFLITE_MODEL = Path(mp.__file__).parent / "modules" / "face_landmark" / "face_landmark.tflite"
+CALIBRATION_DIR = ROOT / "dataset" / "face-type-photo-standard"
+OUTPUT_DIR = ROOT / "models"
+FP32_MODEL = OUTPUT_DIR / "face_landmark.onnx"
+PREPROCESSED_MODEL = OUTPUT_DIR / "face_landmark_pre.onnx"
+INT8_MODEL = OUTPUT_DIR / "face_landmark_int8.onnx"
+MAX_CALIBRATION_IMAGES = 100
+IMG_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+class _FaceCropReader(CalibrationDataReader):
+    """Yield preprocessed 192x192 face crops for calibration."""
+
+    def __init__(self, landmarker: OnnxLandmarker, images: List[Path]) -> None:
+        self._landmarker = landmarker
+        self._input_name = landmarker.input_name
+        self._iter = self._generate(images)
+
+    def _generate(self, images: List[Path]) -> Iterator[Dict[str, object]]:
+        for path in images:
+            image = cv2.imread(path.as_posix())
+            if image is None:
+                print(f"[WARN] Failed to read image: {path}")
+                continue
+            crop = self._landmarker.crop(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+            if crop is None:
+                print(f"[WARN] No face detected: {path}")
+                continue
+            yield {self._input_name: crop[0]}
+
+    def get_next(self) -> Optional[Dict[str, object]]:
+        return next(self._iter, None)
+
+
+def _calibration_images() -> List[Path]:
+    files = sorted(
+        path
+        for path in CALIBRATION_DIR.iterdir()
+        if path.suffix.lower() in IMG_EXTENSIONS
+    )
+    return files[:MAX_CALIBRATION_IMAGES]
+
+
+def _export_onnx() -> None:
+    subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "tf2onnx.convert",
+            "--tflite",
+            TFLITE_MODEL.as_posix(),
+            "--opset",
+            "13",
+            "--output",
+            FP32_MODEL.as_posix(),
+        ],
+        check=True,
+    )
+
+
+def main() -> None:
+    if not CALIBRATION_DIR.exists():
+        raise SystemExit(
+            f"Calibration directory not found: {CALIBRATION_DIR} "
+            "(run scripts/prepare_face_dataset.py first)"
+        )
+    images = _calibration_images()
+    if not images:
+        raise SystemExit(f"No calibration images in {CALIBRATION_DIR}")
+
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    print(f"Exporting {TFLITE_MODEL.name} to {FP32_MODEL}")
+    _export_onnx()
+
+    # 入力形状は固定 (1x192x192x3) なので symbolic shape inference は不要
+    quant_pre_process(
+        FP32_MODEL.as_posix(), PREPROCESSED_MODEL.as_posix(), skip_symbolic_shape=True
+    )
+    reader = _FaceCropReader(OnnxLandmarker(FP32_MODEL.as_posix()), images)
+    print(f"Quantizing with up to {len(images)} calibration image(s)")
+    quantize_static(
+        PREPROCESSED_MODEL.as_posix(),
+        INT8_MODEL.as_posix(),
+        reader,
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        weight_type=QuantType.QInt8,
+        activation_type=QuantType.QInt8,
+    )
+    PREPROCESSED_MODEL.unlink(missing_ok=True)
+    print(f"Done. Wrote {FP32_MODEL} and {INT8_MODEL}.")
+
+
+if __name__ == "__main__":
+    main()